@@ -0,0 +1,137 @@
+import bisect
+import itertools
+import math
+import threading
+import time
+
+ADMIN_PRIORITY = 0
+CHEAP_PRIORITY = 1
+HEAVY_PRIORITY = 2
+
+
+class Rejected(Exception):
+    def __init__(self, retry_after):
+        super().__init__('Service overloaded, retry after %s s' % retry_after)
+        self.retry_after = retry_after
+
+
+class Ticket:
+
+    def __init__(self, controller, method):
+        self.controller = controller
+        self.method = method
+        self.started = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.controller.release(self)
+
+
+class AdmissionController:
+    """Caps in-flight requests per method and in total, and sheds load early.
+
+    Requests over a cap wait in one bounded priority queue shared by all
+    methods, so admin and cheap requests overtake large clients_interests
+    calls whatever method they call; a request is rejected straight away when
+    the queue is full or when its expected wait exceeds ``queue_timeout``, so
+    overload turns into quick 503 answers instead of every request timing out
+    together. Methods not in ``methods`` share one default bucket.
+
+    Admission runs before authentication, so a request with the admin login
+    gets admin priority only when ``verify_admin`` accepts its token; without
+    ``verify_admin`` it is treated like any other request.
+    """
+
+    def __init__(self, max_in_flight=8, limits=None, max_total=None, queue_size=32,
+                 queue_timeout=0.5, heavy_clients=100, admin_login='admin', verify_admin=None,
+                 methods=('online_score', 'clients_interests')):
+        self.max_in_flight = max_in_flight
+        self.limits = limits or {}
+        self.max_total = max_total if max_total is not None else max_in_flight
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.heavy_clients = heavy_clients
+        self.admin_login = admin_login
+        self.verify_admin = verify_admin
+        self.methods = frozenset(methods)
+        self.in_flight = {}
+        self.total = 0
+        self.waiters = []
+        self.service_time = {}
+        self.counter = itertools.count()
+        self.lock = threading.Condition()
+
+    def bucket(self, request):
+        method = request.get('method') if isinstance(request, dict) else None
+        return method if isinstance(method, str) and method in self.methods else None
+
+    def limit(self, method):
+        return self.limits.get(method, self.max_in_flight)
+
+    def priority(self, request):
+        if not isinstance(request, dict):
+            return CHEAP_PRIORITY
+        if request.get('login') == self.admin_login and self.verify_admin is not None \
+                and self.verify_admin(request):
+            return ADMIN_PRIORITY
+        arguments = request.get('arguments')
+        if isinstance(arguments, dict):
+            client_ids = arguments.get('client_ids')
+            if isinstance(client_ids, list) and len(client_ids) > self.heavy_clients:
+                return HEAVY_PRIORITY
+        return CHEAP_PRIORITY
+
+    def has_room(self, method):
+        return self.total < self.max_total and self.in_flight.get(method, 0) < self.limit(method)
+
+    def may_run(self, entry):
+        # a waiter only yields to better placed waiters that could run right now,
+        # so a full method never blocks the queue for the others
+        if not self.has_room(entry[2]):
+            return False
+        return not any(waiter < entry and self.has_room(waiter[2]) for waiter in self.waiters)
+
+    def expected_wait(self, method, ahead):
+        return self.service_time.get(method, 0.0) * (ahead + 1) / min(self.limit(method), self.max_total)
+
+    def retry_after(self, method):
+        return max(1, math.ceil(self.expected_wait(method, len(self.waiters))))
+
+    def acquire(self, request):
+        method = self.bucket(request)
+        entry = (self.priority(request), next(self.counter), method)
+        with self.lock:
+            if self.may_run(entry):
+                return self._admit(method)
+            ahead = sum(1 for waiter in self.waiters if waiter[0] <= entry[0])
+            if len(self.waiters) >= self.queue_size or \
+                    self.expected_wait(method, ahead) > self.queue_timeout:
+                raise Rejected(self.retry_after(method))
+            bisect.insort(self.waiters, entry)
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while not self.may_run(entry):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Rejected(self.retry_after(method))
+                    self.lock.wait(remaining)
+            finally:
+                self.waiters.remove(entry)
+                self.lock.notify_all()
+            return self._admit(method)
+
+    def _admit(self, method):
+        self.in_flight[method] = self.in_flight.get(method, 0) + 1
+        self.total += 1
+        return Ticket(self, method)
+
+    def release(self, ticket):
+        elapsed = time.monotonic() - ticket.started
+        with self.lock:
+            self.in_flight[ticket.method] -= 1
+            self.total -= 1
+            previous = self.service_time.get(ticket.method)
+            self.service_time[ticket.method] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+            self.lock.notify_all()
@@ -6,10 +6,18 @@ import datetime
 import logging.config
 import hashlib
 import uuid
-from scoring import get_score, get_interests
+import signal
+import threading
+import time
+from array import array
+from scoring import get_score, get_interests, get_interests_many
 from optparse import OptionParser
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import store
+import tracing
+import rpc
+import capture
+from admission import AdmissionController, Rejected
 
 SALT = "Otus"
 ADMIN_LOGIN = "admin"
@@ -20,12 +28,14 @@ FORBIDDEN = 403
 NOT_FOUND = 404
 INVALID_REQUEST = 422
 INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
 ERRORS = {
     BAD_REQUEST: "Bad Request",
     FORBIDDEN: "Forbidden",
     NOT_FOUND: "Not Found",
     INVALID_REQUEST: "Invalid Request",
     INTERNAL_ERROR: "Internal Server Error",
+    SERVICE_UNAVAILABLE: "Service Unavailable",
 }
 UNKNOWN = 0
 MALE = 1
@@ -36,6 +46,7 @@ GENDERS = {
     FEMALE: "female",
 }
 DEFAULT_CONFIG_FILE_NAME = 'score_api.cfg'
+logger = logging.getLogger()
 
 
 def _get_score(store=None, phone=None, email=None, birthday=None,
@@ -43,8 +54,12 @@ def _get_score(store=None, phone=None, email=None, birthday=None,
     return get_score(store, phone, email, birthday, gender, first_name, last_name)
 
 
-def _get_interests(store=None, cid=None):
-    return get_interests(store, cid)
+def _get_interests(store=None, cid=None, date=None):
+    return get_interests(store, cid, date)
+
+
+def _get_interests_many(store=None, cids=(), date=None):
+    return get_interests_many(store, cids, date)
 
 
 class ValidationError(Exception):...
@@ -77,6 +92,10 @@ class Field(object):
     def valid_field(self, value):
         pass
 
+    def clean(self, value):
+        self.valid_field(value)
+        return value
+
 
 class CharField(Field):
     def valid_field(self, value):
@@ -135,12 +154,18 @@ class GenderField(Field):
 
 class ClientIDsField(Field):
     def valid_field(self, value):
+        self.clean(value)
+
+    def clean(self, value):
         if not isinstance(value, list):
             raise ValidationError('His field must be a list')
-        if not all(isinstance(number, int) for number in value):
+        try:
+            ids = array('q', value)
+        except (TypeError, OverflowError):
             raise ValidationError('His list must contain integer')
-        if not all(number >= 0 for number in value):
+        if ids and min(ids) < 0:
             raise ValidationError('His list must contain positive integer')
+        return ids
 
 
 class MetaClassRequest(type):
@@ -168,7 +193,7 @@ class Request(metaclass=MetaClassRequest):
                 try:
                     getattr(self, '__inst_cls')[name_field].valid_required_nullable(val_field)
                     try:
-                        getattr(self, '__inst_cls')[name_field].valid_field(val_field)
+                        setattr(self, name_field, getattr(self, '__inst_cls')[name_field].clean(val_field))
                         self.list_not_null_fields.append(name_field)
                     except ValidationError as err:
                         if val_field not in (None, {}, [], (), ''):
@@ -218,10 +243,19 @@ class MethodRequest(Request):
         return self.login == ADMIN_LOGIN
 
 
+def admin_token():
+    return hashlib.sha512(
+        bytes(datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT, encoding='utf-8')).hexdigest()
+
+
+def verify_admin(request):
+    # admission sees the raw request before validation, so only the token is trusted
+    return request.get('token') == admin_token()
+
+
 def check_auth(request):
     if request.is_admin:
-        digest = hashlib.sha512(
-            bytes(datetime.datetime.now().strftime("%Y%m%d%H") + ADMIN_SALT, encoding='utf-8')).hexdigest()
+        digest = admin_token()
     else:
         digest = hashlib.sha512(bytes(request.account + request.login + SALT, encoding='utf-8')).hexdigest()
     if digest == request.token:
@@ -250,15 +284,14 @@ def clients_interests_request(store, request, context):
     if interest_request.dict_err_type_value:
         return interest_request.dict_err_type_value, INVALID_REQUEST
     list_par = interest_request.list_not_null_fields
-    col_clients = 0
-    answer_get_interests = {}
     if "client_ids" in list_par:
-         for client in getattr(interest_request, 'client_ids'):
-            args = {'store': store}
-            args['cid'] = str(client)
-            col_clients += 1
-            answer_get_interests[client] = _get_interests(**args)
-         context["nclients"] = col_clients
+        client_ids = getattr(interest_request, 'client_ids')
+        unique_ids = array('q', dict.fromkeys(client_ids))
+        date = None
+        if "date" in list_par and getattr(interest_request, 'date'):
+            date = datetime.datetime.strptime(getattr(interest_request, 'date'), '%d.%m.%Y').date()
+        answer_get_interests = _get_interests_many(store=store, cids=unique_ids, date=date)
+        context["nclients"] = len(client_ids)
     else:
         interest_request.dict_err_type_value['client_ids'] = \
             ValidationError('"client_ids" should not be dusty ').args[0]
@@ -272,15 +305,19 @@ def method_handler(request, ctx, store):
         "online_score": online_score_request,
         "clients_interests": clients_interests_request
     }
-    request_body = MethodRequest(request['body'])
-    request_body.validated_argument()
+    with tracing.span('validate'):
+        request_body = MethodRequest(request['body'])
+        request_body.validated_argument()
     if request_body.dict_err_type_value:
         return request_body.dict_err_type_value, INVALID_REQUEST
-    if check_auth(request_body):
+    with tracing.span('auth'):
+        authorized = check_auth(request_body)
+    if authorized:
         if request_body.is_admin:
             return {'score': 42}, OK
         else:
-            return handler[request_body.method](store, request['body']['arguments'], ctx)
+            with tracing.span('handler'):
+                return handler[request_body.method](store, request['body']['arguments'], ctx)
     else:
         return ERRORS[FORBIDDEN], FORBIDDEN
 
@@ -290,47 +327,120 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
         "method": method_handler
     }
     store = store.Store(store.WorksRedis(), attempt_request=5, delay=0.1, cache_size=5)
+    admission = AdmissionController(max_in_flight=8, max_total=12, queue_size=32, queue_timeout=0.5,
+                                    admin_login=ADMIN_LOGIN, verify_admin=verify_admin)
+    exporter = None
+    capture = None
 
     def get_request_id(self, headers):
         return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
 
     def do_POST(self):
-        response, code = {}, OK
+        # the capture replays requests by arrival, so the time is taken before any work
+        received = time.time()
         context = {"request_id": self.get_request_id(self.headers)}
+        with tracing.trace(context, self.exporter) as trace:
+            code, body, retry_after = self.process(context, received)
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            if retry_after is not None:
+                self.send_header("Retry-After", str(retry_after))
+            self.send_header("Server-Timing", trace.server_timing())
+            self.end_headers()
+        logger.info(context)
+        self.wfile.write(body)
+        return
+
+    def process(self, context, received=None):
+        response, code = {}, OK
         request = None
+        retry_after = None
         try:
-            data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request = json.loads(data_string)
+            with tracing.span('read'):
+                data_string = self.rfile.read(int(self.headers['Content-Length']))
+                request = json.loads(data_string)
         except:
             code = BAD_REQUEST
         if request:
             path = self.path.strip("/")
             logger.info("%s: %s %s" % (self.path, data_string, context["request_id"]))
             if path in self.router:
-                try:
-                    response, code = self.router[path]({"body": request, "headers": self.headers}, context, self.store)
-                except Exception as e:
-                    logger.exception("Unexpected error: %s" % e)
-                    code = INTERNAL_ERROR
+                response, code, retry_after = dispatch(self.router[path], request, context,
+                                                       self.store, self.admission, self.headers)
             else:
                 code = NOT_FOUND
-        self.send_response(code)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
-        else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
-        context.update(r)
-        logger.info(context)
-        self.wfile.write(json.dumps(r, ensure_ascii=False).encode("utf-8"))
-        return
+        body = serialize(response, code, context)
+        if request and self.capture is not None and self.capture.sampled():
+            answer = {key: context[key] for key in ("response", "error", "code") if key in context}
+            self.capture.record(self.path, request, answer, ts=received)
+        return code, body, retry_after
+
+
+def dispatch(handler, request, context, store, admission, headers=None):
+    response, code, retry_after = {}, OK, None
+    try:
+        with tracing.span('admission'):
+            ticket = admission.acquire(request)
+        with ticket:
+            response, code = handler({"body": request, "headers": headers or {}}, context, store)
+    except Rejected as e:
+        logger.warning("Request %s rejected: %s" % (context["request_id"], e))
+        code = SERVICE_UNAVAILABLE
+        retry_after = e.retry_after
+    except Exception as e:
+        logger.exception("Unexpected error: %s" % e)
+        code = INTERNAL_ERROR
+    return response, code, retry_after
+
+
+def serialize(response, code, context, **extra):
+    if code not in ERRORS:
+        r = {"response": response, "code": code}
+    else:
+        r = {"error": response or ERRORS.get(code, "Unknown Error"), "code": code}
+    r.update(extra)
+    context.update(r)
+    with tracing.span('serialize'):
+        return json.dumps(r, ensure_ascii=False).encode("utf-8")
+
+
+def rpc_handler(data, request_id):
+    context = {"request_id": request_id}
+    with tracing.trace(context, MainHTTPHandler.exporter):
+        response, code, retry_after = {}, OK, None
+        try:
+            with tracing.span('read'):
+                request = json.loads(data)
+        except ValueError:
+            request = None
+            code = BAD_REQUEST
+        if request:
+            response, code, retry_after = dispatch(method_handler, request, context,
+                                                   MainHTTPHandler.store, MainHTTPHandler.admission)
+        extra = {"retry_after": retry_after} if retry_after is not None else {}
+        body = serialize(response, code, context, **extra)
+    logger.info(context)
+    return body
+
+
+def rpc_error(code):
+    extra = {"retry_after": 1} if code == SERVICE_UNAVAILABLE else {}
+    return serialize({}, code, {}, **extra)
 
 
 if __name__ == "__main__":
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("--rpc-port", action="store", type=int, help="port of the framed RPC listener", default=None)
+    op.add_option("--rpc-socket", action="store", help="unix socket of the framed RPC listener", default=None)
+    op.add_option("--cache-snapshot", action="store", help="file to keep the in-process cache between restarts",
+                  default=None)
+    op.add_option("--snapshot-interval", action="store", type=float, help="seconds between cache snapshots",
+                  default=None)
+    op.add_option("--capture", action="store", help="file to record sampled requests in JSON lines", default=None)
+    op.add_option("--capture-rate", action="store", type=float, help="share of requests to record", default=1.0)
+    op.add_option("-t", "--trace", action="store", help="file for request spans in JSON lines", default=None)
     op.add_option("-c", "--config",
                   action="store",
                   help="file config must are *.cfg",
@@ -342,7 +452,22 @@ if __name__ == "__main__":
     except:
         logger = logging.basicConfig(filename=opts.log, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
+    if opts.cache_snapshot:
+        MainHTTPHandler.store.enable_snapshot(opts.cache_snapshot, opts.snapshot_interval)
+    if opts.capture:
+        MainHTTPHandler.capture = capture.Capture(opts.capture, opts.capture_rate)
+    if opts.trace:
+        MainHTTPHandler.exporter = tracing.FileExporter(opts.trace)
+    server = ThreadingHTTPServer(("localhost", opts.port), MainHTTPHandler)
+    rpc_address = opts.rpc_socket or (("localhost", opts.rpc_port) if opts.rpc_port else None)
+    rpc_server = None
+    if rpc_address:
+        rpc_server = rpc.make_server(rpc_address, rpc_handler, error=rpc_error)
+        threading.Thread(target=rpc_server.serve_forever, daemon=True).start()
+        logger.info("Starting RPC listener at %s" % (rpc_address,))
+    # a deploy stops the worker with SIGTERM; shutdown() has to be called from
+    # another thread than serve_forever() so that the cleanup below still runs
+    signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=server.shutdown).start())
     logger.info("Starting server at %s" % opts.port)
     try:
         server.serve_forever()
@@ -351,4 +476,12 @@ if __name__ == "__main__":
     except Exception as err:
         logger.exception(err)
     server.server_close()
+    if rpc_server:
+        rpc_server.shutdown()
+        rpc_server.server_close()
+    MainHTTPHandler.store.close()
+    if MainHTTPHandler.capture:
+        MainHTTPHandler.capture.close()
+    if MainHTTPHandler.exporter:
+        MainHTTPHandler.exporter.close()
 
@@ -0,0 +1,34 @@
+import json
+import os
+import random
+import threading
+import time
+
+
+class Capture:
+    """Appends sampled requests with their answers to a JSON lines file.
+
+    Requests are written as received, account, login and token included, so
+    the file is created readable by its owner only. Lines are appended when
+    the answer is ready; ``ts`` is the arrival time of the request.
+    """
+
+    def __init__(self, path, rate=1.0):
+        self.rate = rate
+        self.lock = threading.Lock()
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        os.fchmod(fd, 0o600)
+        self.file = os.fdopen(fd, 'a', buffering=1, encoding='utf-8')
+
+    def sampled(self):
+        return self.rate >= 1 or random.random() < self.rate
+
+    def record(self, path, request, answer, ts=None):
+        line = json.dumps({"ts": time.time() if ts is None else ts, "path": path,
+                           "request": request, "answer": answer}, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + '\n')
+
+    def close(self):
+        with self.lock:
+            self.file.close()
@@ -25,3 +25,37 @@ def cases(cases, count={}):
     return decorator
 
 
+
+
+class MemoryStore:
+    """In-process stand-in for store.Store, values come back as strings like from redis."""
+
+    def __init__(self):
+        self.data = {}
+        self.index = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def get_many(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def cache_get(self, key):
+        return self.data.get(key)
+
+    def cache_set(self, key, value, expire):
+        self.data[key] = str(value)
+
+    def index_set(self, key, score, member):
+        bucket = self.index.setdefault(key, {})
+        for old in [old for old, old_score in bucket.items() if old_score == score]:
+            del bucket[old]
+        bucket[member] = score
+
+    def get_latest_many(self, keys, max_score):
+        latest = []
+        for key in keys:
+            members = sorted((score, member) for member, score in self.index.get(key, {}).items()
+                             if max_score == "+inf" or score <= max_score)
+            latest.append(members[-1][1] if members else None)
+        return latest
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from optparse import OptionParser
+
+
+def load(path):
+    # lines are written when requests finish, so they are put back in arrival order
+    with open(path, encoding='utf-8') as file:
+        return sorted((json.loads(line) for line in file if line.strip()), key=lambda record: record["ts"])
+
+
+def schedule(records, speed):
+    # offsets from the start of the replay, speed 0 sends everything at once
+    if not records:
+        return []
+    first = min(record["ts"] for record in records)
+    return [(record["ts"] - first) / speed if speed else 0.0 for record in records]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def send(url, record, timeout):
+    data = json.dumps(record["request"]).encode("utf-8")
+    request = urllib.request.Request(url.rstrip("/") + record["path"], data,
+                                     {"Content-Type": "application/json"})
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            body = response.read()
+    except urllib.error.HTTPError as err:
+        body = err.read()
+    latency = time.perf_counter() - started
+    try:
+        answer = json.loads(body)
+    except ValueError:
+        answer = {"error": body.decode("utf-8", "replace")}
+    return latency, answer
+
+
+def replay(records, url, speed=1.0, concurrency=8, timeout=10):
+    results = [None] * len(records)
+    slots = threading.BoundedSemaphore(concurrency)
+
+    def run(index, record):
+        try:
+            results[index] = send(url, record, timeout)
+        except Exception as err:
+            results[index] = (None, {"error": str(err)})
+        finally:
+            slots.release()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, (record, offset) in enumerate(zip(records, schedule(records, speed))):
+            delay = started + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            slots.acquire()
+            executor.submit(run, index, record)
+    return results
+
+
+def report(records, results):
+    latencies = [latency * 1000 for latency, _ in results if latency is not None]
+    diffs = [(record, answer) for record, (_, answer) in zip(records, results) if record.get("answer") != answer]
+    lines = ["requests: %s, failed: %s, response diffs: %s" % (len(results), len(results) - len(latencies),
+                                                              len(diffs))]
+    if latencies:
+        lines.append("latency ms: p50 %.2f, p90 %.2f, p99 %.2f, max %.2f" % (
+            percentile(latencies, 50), percentile(latencies, 90), percentile(latencies, 99), max(latencies)))
+    for record, answer in diffs[:10]:
+        lines.append("diff %s: recorded %s, got %s" % (record["request"].get("method"),
+                                                       json.dumps(record.get("answer"), ensure_ascii=False),
+                                                       json.dumps(answer, ensure_ascii=False)))
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    op = OptionParser(usage="%prog [options] capture.jsonl")
+    op.add_option("-u", "--url", action="store", default="http://127.0.0.1:8080")
+    op.add_option("-s", "--speed", action="store", type=float, default=1.0,
+                  help="1 replays at recorded speed, N is N times faster, 0 is maximum rate")
+    op.add_option("-n", "--concurrency", action="store", type=int, default=8)
+    op.add_option("-t", "--timeout", action="store", type=float, default=10)
+    (opts, args) = op.parse_args()
+    if len(args) != 1:
+        op.error("capture file is required")
+    captured = load(args[0])
+    print(report(captured, replay(captured, opts.url, opts.speed, opts.concurrency, opts.timeout)))
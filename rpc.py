@@ -0,0 +1,171 @@
+import errno
+import itertools
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# every frame is a request id and a body length followed by the JSON body;
+# the response carries the id of its request, so a connection may have many
+# requests in flight and get the answers back in any order
+FRAME_HEADER = struct.Struct('!II')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+INTERNAL_ERROR = 500
+SERVICE_UNAVAILABLE = 503
+
+
+def read_frame(rfile):
+    header = rfile.read(FRAME_HEADER.size)
+    if len(header) < FRAME_HEADER.size:
+        return None, None
+    request_id, length = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ValueError('Frame of %s bytes is too large' % length)
+    body = rfile.read(length)
+    if len(body) < length:
+        return None, None
+    return request_id, body
+
+
+def pack_frame(request_id, body):
+    return FRAME_HEADER.pack(request_id, len(body)) + body
+
+
+def error_body(code):
+    return json.dumps({"error": "RPC error", "code": code}).encode("utf-8")
+
+
+class RPCHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.write_lock = threading.Lock()
+        # frames over the per connection or the server wide limit are answered
+        # with 503 right away instead of queueing in front of the workers
+        connection_slots = threading.BoundedSemaphore(self.server.max_connection_pending)
+        pending = []
+        try:
+            while True:
+                request_id, body = read_frame(self.rfile)
+                if body is None:
+                    break
+                if not connection_slots.acquire(blocking=False):
+                    self.send(request_id, self.server.error(SERVICE_UNAVAILABLE))
+                    continue
+                if not self.server.slots.acquire(blocking=False):
+                    connection_slots.release()
+                    self.send(request_id, self.server.error(SERVICE_UNAVAILABLE))
+                    continue
+                pending.append(self.server.executor.submit(self.reply, request_id, body, connection_slots))
+                pending = [future for future in pending if not future.done()]
+        except (ValueError, OSError):
+            pass
+        wait(pending)
+
+    def reply(self, request_id, body, connection_slots):
+        try:
+            answer = self.server.dispatch(body, request_id)
+        except Exception:
+            answer = self.server.error(INTERNAL_ERROR)
+        finally:
+            self.server.slots.release()
+            connection_slots.release()
+        self.send(request_id, answer)
+
+    def send(self, request_id, body):
+        try:
+            with self.write_lock:
+                self.connection.sendall(pack_frame(request_id, body))
+        except OSError:
+            pass
+
+
+class RPCServerMixIn(socketserver.ThreadingMixIn):
+    daemon_threads = True
+
+    def __init__(self, address, dispatch, workers=8, max_pending=64, max_connection_pending=32, error=None):
+        self.dispatch = dispatch
+        self.error = error or error_body
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.max_connection_pending = max_connection_pending
+        super().__init__(address, RPCHandler)
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+class ThreadingRPCServer(RPCServerMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+
+
+class ThreadingUnixRPCServer(RPCServerMixIn, socketserver.UnixStreamServer):
+
+    bound = False
+
+    def server_bind(self):
+        remove_stale_socket(self.server_address)
+        super().server_bind()
+        self.bound = True
+
+    def server_close(self):
+        super().server_close()
+        # a failed bind closes the server too, the file then belongs to someone else
+        if self.bound and os.path.exists(self.server_address):
+            os.remove(self.server_address)
+            self.bound = False
+
+
+def remove_stale_socket(path):
+    if not os.path.exists(path) or not stat.S_ISSOCK(os.stat(path).st_mode):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.remove(path)
+    else:
+        raise OSError(errno.EADDRINUSE, 'Another server is listening on %s' % path)
+    finally:
+        probe.close()
+
+
+def make_server(address, dispatch, workers=8, max_pending=64, max_connection_pending=32, error=None):
+    server_cls = ThreadingUnixRPCServer if isinstance(address, str) else ThreadingRPCServer
+    return server_cls(address, dispatch, workers, max_pending, max_connection_pending, error)
+
+
+class RPCClient:
+
+    def __init__(self, address, timeout=None):
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(address)
+        self.rfile = self.sock.makefile('rb')
+        self.ids = itertools.count(1)
+        self.answers = {}
+
+    def send(self, body):
+        request_id = next(self.ids) & 0xFFFFFFFF
+        self.sock.sendall(pack_frame(request_id, body))
+        return request_id
+
+    def receive(self, request_id):
+        while request_id not in self.answers:
+            answer_id, body = read_frame(self.rfile)
+            if body is None:
+                raise ConnectionError('Connection closed by server')
+            self.answers[answer_id] = body
+        return self.answers.pop(request_id)
+
+    def call(self, body):
+        return self.receive(self.send(body))
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
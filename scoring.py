@@ -1,20 +1,46 @@
+import base64
 import hashlib
 import json
 
 
-def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+SCORE_CACHE_VERSION = 1
+# read pre-versioned uid:<md5> keys on a miss, switch off once they expired
+SCORE_CACHE_LEGACY_FALLBACK = True
+
+
+def score_key(phone=None, email=None, birthday=None, gender=None, first_name=None, last_name=None):
+    # every field is length-prefixed so that values can not run into each other,
+    # bumping SCORE_CACHE_VERSION drops all cached scores at once
+    fields = (phone, email, birthday, gender, first_name, last_name)
+    encoded = "".join("%d:%s" % (len(value), value) for value in
+                      ("" if field is None else str(field) for field in fields))
+    digest = hashlib.blake2b(encoded.encode("utf-8"), digest_size=12).digest()
+    return "s%d:%s" % (SCORE_CACHE_VERSION, base64.urlsafe_b64encode(digest).decode("ascii"))
+
+
+def legacy_score_key(phone=None, birthday=None, first_name=None, last_name=None):
     key_parts = [
         first_name or "",
         last_name or "",
         str(phone) or "",
         birthday if birthday is not None else "",
     ]
-    key = "uid:" + hashlib.md5("".join(key_parts).encode('utf-8')).hexdigest()
-    # try get from cache,
-    # fallback to heavy calculation in case of cache miss
-    score = float(store.cache_get(key) or 0)
-    if score:
-        return score
+    return "uid:" + hashlib.md5("".join(key_parts).encode('utf-8')).hexdigest()
+
+
+def get_score(store, phone, email, birthday=None, gender=None, first_name=None, last_name=None):
+    key = score_key(phone, email, birthday, gender, first_name, last_name)
+    # try get from cache, a stored "0.0" is a hit and only None is a miss,
+    # fallback to the pre-versioned key while old entries live out their ttl
+    # and to heavy calculation in case of cache miss; a legacy value is only
+    # served, the legacy key leaves out email and gender and may belong to
+    # another set of arguments, so it is never copied under the precise key
+    cached = store.cache_get(key)
+    if cached is None and SCORE_CACHE_LEGACY_FALLBACK:
+        cached = store.cache_get(legacy_score_key(phone, birthday, first_name, last_name))
+    if cached is not None:
+        return float(cached)
+    score = 0.0
     if phone:
         score += 1.5
     if email:
@@ -24,11 +50,93 @@ def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
     if first_name and last_name:
         score += 0.5
     # cache for 60 minutes
-    store.cache_set(key, score, 60 * 60)
+    store.cache_set(key, repr(float(score)), 60 * 60)
     return score
 
 
-def get_interests(store, cid):
-    r = store.get("i:%s" % cid)
-    return json.loads(r) if r else []
+# a vocabulary may only grow at the end; anything else needs a new version
+INTEREST_VOCABULARIES = {
+    1: ("cars", "pets", "travel", "hi-tech", "sport", "music", "books", "tv", "cinema", "geek", "otus"),
+}
+INTEREST_VOCABULARY_VERSION = 1
+INTEREST_VERSION_BITS = 4
+# "bitset" stores interests as an integer, "json" as a string array
+INTEREST_ENCODING = "bitset"
+
+
+def _byte_tables(vocabulary):
+    # for every byte of the mask all 256 values map to their interests
+    tables = []
+    for offset in range(0, len(vocabulary), 8):
+        chunk = vocabulary[offset:offset + 8]
+        tables.append(tuple(tuple(name for bit, name in enumerate(chunk) if byte >> bit & 1)
+                            for byte in range(256)))
+    return tables
+
+
+INTEREST_TABLES = {version: _byte_tables(vocabulary) for version, vocabulary in INTEREST_VOCABULARIES.items()}
+INTEREST_BITS = {version: {name: 1 << bit for bit, name in enumerate(vocabulary)}
+                 for version, vocabulary in INTEREST_VOCABULARIES.items()}
+
+
+def encode_interests(interests):
+    bits = INTEREST_BITS[INTEREST_VOCABULARY_VERSION]
+    if INTEREST_ENCODING != "bitset" or not all(name in bits for name in interests):
+        return json.dumps(interests)
+    mask = 0
+    for name in interests:
+        mask |= bits[name]
+    # an integer value is kept int-encoded by redis
+    return str(mask << INTEREST_VERSION_BITS | INTEREST_VOCABULARY_VERSION)
+
+
+def decode_interests(value):
+    if not value:
+        return []
+    # anything but a plain number is a value written before the bitset encoding
+    if not (value.isascii() and value.isdigit()):
+        return json.loads(value)
+    number = int(value)
+    tables = INTEREST_TABLES.get(number & (1 << INTEREST_VERSION_BITS) - 1)
+    if tables is None:
+        # written with a vocabulary this build does not know, treat it as a miss
+        return []
+    mask = number >> INTEREST_VERSION_BITS
+    interests = []
+    for table in tables:
+        interests.extend(table[mask & 0xFF])
+        mask >>= 8
+    return interests
+
+
+def decode_interests_many(values):
+    # masks repeat a lot across clients, so every distinct value is decoded once
+    decoded = {}
+    interests = []
+    for value in values:
+        if value not in decoded:
+            decoded[value] = decode_interests(value)
+        interests.append(list(decoded[value]) if isinstance(decoded[value], list) else decoded[value])
+    return interests
+
+
+def set_interests(store, cid, interests, date):
+    # one sorted set per client, scored by the day the interests were recorded
+    member = "%s:%s" % (date.strftime("%Y%m%d"), encode_interests(interests))
+    return store.index_set("iz:%s" % cid, date.toordinal(), member)
+
+
+def get_interests(store, cid, date=None):
+    return get_interests_many(store, [cid], date)[cid]
+
 
+def get_interests_many(store, cids, date=None):
+    # take the latest bucket at or before the date,
+    # fallback to the flat i:<cid> key for clients without an index
+    max_score = date.toordinal() if date is not None else "+inf"
+    buckets = store.get_latest_many(["iz:%s" % cid for cid in cids], max_score)
+    found = [(cid, member.split(":", 1)[1]) for cid, member in zip(cids, buckets) if member]
+    missing = [cid for cid, member in zip(cids, buckets) if not member]
+    values = [value for _, value in found] + store.get_many(["i:%s" % cid for cid in missing])
+    interests = dict(zip([cid for cid, _ in found] + missing, decode_interests_many(values)))
+    return {cid: interests[cid] for cid in cids}
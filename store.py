@@ -1,6 +1,16 @@
+import logging
+import mmap
+import os
 import redis
+import struct
+import threading
 import time
-from functools import lru_cache
+import tracing
+from collections import OrderedDict
+
+SNAPSHOT_MAGIC = b'SCL1'
+SNAPSHOT_HEADER = struct.Struct('!4sI')
+SNAPSHOT_ENTRY = struct.Struct('!dII')
 
 
 class WorksRedis:
@@ -33,40 +43,259 @@ class WorksRedis:
         except redis.ConnectionError:
             raise ConnectionError
 
+    def get_with_ttl(self, key):
+        # the value and its remaining ttl in milliseconds, in one round trip
+        try:
+            pipe = self.server.pipeline(transaction=False)
+            pipe.get(key)
+            pipe.pttl(key)
+            value, ttl = pipe.execute()
+            return value, ttl
+        except redis.TimeoutError:
+            raise TimeoutError
+        except redis.ConnectionError:
+            raise ConnectionError
+
+    def mget(self, keys):
+        try:
+            return self.server.mget(keys)
+        except redis.TimeoutError:
+            raise TimeoutError
+        except redis.ConnectionError:
+            raise ConnectionError
+
+    def zreplace(self, key, score, member):
+        # drop whatever the bucket held before, in one MULTI with the new member
+        try:
+            pipe = self.server.pipeline(transaction=True)
+            pipe.zremrangebyscore(key, score, score)
+            pipe.zadd(key, {member: score})
+            return pipe.execute()[-1]
+        except redis.TimeoutError:
+            raise TimeoutError
+        except redis.ConnectionError:
+            raise ConnectionError
+
+    def zlatest_many(self, keys, max_score):
+        try:
+            pipe = self.server.pipeline(transaction=False)
+            for key in keys:
+                pipe.zrevrangebyscore(key, max_score, '-inf', start=0, num=1)
+            return [members[0] if members else None for members in pipe.execute()]
+        except redis.TimeoutError:
+            raise TimeoutError
+        except redis.ConnectionError:
+            raise ConnectionError
+
+
+def write_snapshot(path, entries):
+    # entries are (key, value, expires_at); the file is written aside and
+    # renamed so a crash never leaves a half written snapshot behind
+    parts = [SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(entries))]
+    for key, value, expires_at in entries:
+        key, value = key.encode('utf-8'), value.encode('utf-8')
+        parts.append(SNAPSHOT_ENTRY.pack(expires_at, len(key), len(value)))
+        parts.append(key)
+        parts.append(value)
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'wb') as file:
+        file.write(b''.join(parts))
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path, now=None):
+    now = time.time() if now is None else now
+    try:
+        with open(path, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            magic, count = SNAPSHOT_HEADER.unpack_from(data, 0)
+            if magic != SNAPSHOT_MAGIC:
+                return []
+            offset = SNAPSHOT_HEADER.size
+            entries = []
+            for _ in range(count):
+                expires_at, key_len, value_len = SNAPSHOT_ENTRY.unpack_from(data, offset)
+                offset += SNAPSHOT_ENTRY.size
+                if expires_at > now:
+                    key = data[offset:offset + key_len].decode('utf-8')
+                    value = data[offset + key_len:offset + key_len + value_len].decode('utf-8')
+                    entries.append((key, value, expires_at))
+                offset += key_len + value_len
+            return entries
+    except (OSError, ValueError, struct.error):
+        return []
+
 
 class Store:
-    cache_size = 10
 
-    def __init__(self, cls, attempt_request=3, delay=0.1, cache_size=10):
+    def __init__(self, cls, attempt_request=3, delay=0.1, cache_size=10, cache_ttl=60):
         self.store = cls
         self.attempt_request = attempt_request
         self.delay = delay
         self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.cache = OrderedDict()
+        self.cache_lock = threading.Lock()
+        self.snapshot = None
+        self.snapshot_loaded = True
+        self.snapshot_lock = threading.Lock()
+        self.snapshot_stop = threading.Event()
+        self.snapshot_saver = None
 
-    def get(self, key):
-        for attempt in range(self.attempt_request):
-            try:
-                return self.store.get(key)
-            except TimeoutError:
-                self.error = TimeoutError
-            except ConnectionError:
-                self.error = ConnectionError
-            time.sleep(attempt * self.delay)
-        else:
-            raise self.error
+    def enable_snapshot(self, path, interval=None):
+        self.snapshot = path
+        self.snapshot_loaded = False
+        if interval:
+            self.snapshot_saver = threading.Thread(target=self._save_periodically, args=(interval,), daemon=True)
+            self.snapshot_saver.start()
 
-    def cache_set(self, key, value, expire):
-        for attempt in range(self.attempt_request):
+    def _save_periodically(self, interval):
+        while not self.snapshot_stop.wait(interval):
             try:
-                return self.store.set(key, value, expire)
-            except (TimeoutError, ConnectionError):
+                self.save_snapshot()
+            except OSError:
+                logging.exception("Cache snapshot to %s failed" % self.snapshot)
+
+    def _load_snapshot(self):
+        entries = read_snapshot(self.snapshot)
+        with self.cache_lock:
+            if self.snapshot_loaded:
+                return
+            self.snapshot_loaded = True
+            # snapshot entries are older than anything used since startup, so they
+            # go to the least recently used end in the order they were saved
+            cache = OrderedDict((key, (value, expires_at)) for key, value, expires_at in entries
+                                if key not in self.cache)
+            cache.update(self.cache)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+            self.cache = cache
+
+    def save_snapshot(self):
+        if not self.snapshot:
+            return
+        # an idle process has not read the old snapshot yet, and writing
+        # the empty cache over it would drop the warm state
+        if not self.snapshot_loaded:
+            self._load_snapshot()
+        with self.snapshot_lock:
+            now = time.time()
+            with self.cache_lock:
+                entries = [(key, value, expires_at) for key, (value, expires_at) in self.cache.items()
+                           if expires_at > now]
+            write_snapshot(self.snapshot, entries)
+
+    def close(self):
+        self.snapshot_stop.set()
+        if self.snapshot_saver is not None:
+            self.snapshot_saver.join()
+        self.save_snapshot()
+
+    def _cache_lookup(self, key):
+        if not self.snapshot_loaded:
+            self._load_snapshot()
+        with self.cache_lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self.cache[key]
+                return None
+            self.cache.move_to_end(key)
+            return entry[0]
+
+    def _cache_remote(self, key, value, ttl):
+        # never keep a value longer than redis does; a key that expired
+        # between GET and PTTL (-2) is served but not kept
+        if ttl == -1:
+            self._cache_store(key, value, self.cache_ttl)
+        elif ttl > 0:
+            self._cache_store(key, value, min(self.cache_ttl, ttl / 1000.0))
+
+    def _cache_store(self, key, value, expire):
+        with self.cache_lock:
+            self.cache[key] = (str(value), time.time() + expire)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def get(self, key):
+        with tracing.span('store_get') as span:
+            for attempt in range(self.attempt_request):
+                span.retries = attempt
+                try:
+                    return self.store.get(key)
+                except TimeoutError:
+                    self.error = TimeoutError
+                except ConnectionError:
+                    self.error = ConnectionError
                 time.sleep(attempt * self.delay)
+            else:
+                raise self.error
 
-    @lru_cache(maxsize=cache_size)
-    def cache_get(self, key):
-        for attempt in range(self.attempt_request):
-            try:
-                return self.store.get(key)
-            except (TimeoutError, ConnectionError):
+    def get_many(self, keys):
+        if not keys:
+            return []
+        with tracing.span('store_get_many') as span:
+            for attempt in range(self.attempt_request):
+                span.retries = attempt
+                try:
+                    return self.store.mget(keys)
+                except TimeoutError:
+                    self.error = TimeoutError
+                except ConnectionError:
+                    self.error = ConnectionError
+                time.sleep(attempt * self.delay)
+            else:
+                raise self.error
+
+    def get_latest_many(self, keys, max_score):
+        if not keys:
+            return []
+        with tracing.span('store_get_latest_many') as span:
+            for attempt in range(self.attempt_request):
+                span.retries = attempt
+                try:
+                    return self.store.zlatest_many(keys, max_score)
+                except TimeoutError:
+                    self.error = TimeoutError
+                except ConnectionError:
+                    self.error = ConnectionError
                 time.sleep(attempt * self.delay)
+            else:
+                raise self.error
+
+    def index_set(self, key, score, member):
+        with tracing.span('store_index_set') as span:
+            for attempt in range(self.attempt_request):
+                span.retries = attempt
+                try:
+                    return self.store.zreplace(key, score, member)
+                except (TimeoutError, ConnectionError):
+                    time.sleep(attempt * self.delay)
+
+    def cache_set(self, key, value, expire):
+        with tracing.span('store_cache_set') as span:
+            for attempt in range(self.attempt_request):
+                span.retries = attempt
+                try:
+                    result = self.store.set(key, value, expire)
+                    self._cache_store(key, value, expire)
+                    return result
+                except (TimeoutError, ConnectionError):
+                    time.sleep(attempt * self.delay)
+
+    def cache_get(self, key):
+        value = self._cache_lookup(key)
+        if value is not None:
+            return value
+        with tracing.span('store_cache_get') as span:
+            for attempt in range(self.attempt_request):
+                span.retries = attempt
+                try:
+                    value, ttl = self.store.get_with_ttl(key)
+                    if value is not None:
+                        self._cache_remote(key, value, ttl)
+                    return value
+                except (TimeoutError, ConnectionError):
+                    time.sleep(attempt * self.delay)
 
@@ -0,0 +1,171 @@
+import datetime
+import hashlib
+import json
+import os
+import time
+import timeit
+import unittest
+import warnings
+import api
+import scoring
+from libtools import MemoryStore
+
+# the baseline depends on the machine, so it is kept out of git (see .gitignore)
+BASELINE_FILE = os.environ.get('BENCHMARK_BASELINE', os.path.join(os.path.dirname(__file__), 'baseline.json'))
+THRESHOLD = float(os.environ.get('BENCHMARK_THRESHOLD', 25))
+UPDATE = bool(os.environ.get('BENCHMARK_UPDATE'))
+REPEAT = 9
+MIN_TIME = 0.1
+# a result over the threshold is measured again after a pause before the
+# benchmark fails, so a burst of load on a shared machine does not fail the run
+REMEASURE = 3
+REMEASURE_PAUSE = 1
+
+
+class MissStore(MemoryStore):
+
+    def cache_set(self, key, value, expire):
+        pass
+
+
+def valid_token(account, login):
+    return hashlib.sha512(bytes(account + login + api.SALT, encoding='utf-8')).hexdigest()
+
+
+def admin_token():
+    return hashlib.sha512(bytes(datetime.datetime.now().strftime("%Y%m%d%H") + api.ADMIN_SALT,
+                                encoding='utf-8')).hexdigest()
+
+
+def validate(field, value):
+    try:
+        field.valid_required_nullable(value)
+        field.clean(value)
+    except api.ValidationError:
+        pass
+
+
+def build(request_cls, request):
+    # Request fills the dict it gets with missing fields, so every run needs its own copy
+    request_cls(dict(request)).validated_argument()
+
+
+@unittest.skipUnless(os.environ.get('BENCHMARK'), 'set BENCHMARK=1 to run micro-benchmarks')
+class TestBenchmark(unittest.TestCase):
+    """Times the validation layer and compares every result with the baseline file.
+
+    A benchmark fails when it is more than BENCHMARK_THRESHOLD percent slower
+    than its baseline and stays that slow on REMEASURE more measurements;
+    benchmarks missing from the baseline are recorded without being compared
+    and listed at the end of the run, and BENCHMARK_UPDATE=1 rewrites the
+    baseline with the current results.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.baseline = {}
+        if os.path.exists(BASELINE_FILE):
+            with open(BASELINE_FILE) as file:
+                cls.baseline = json.load(file)
+        cls.results = {}
+        cls.uncompared = []
+
+    @classmethod
+    def tearDownClass(cls):
+        updated = dict(cls.baseline)
+        for name, value in cls.results.items():
+            if UPDATE or name not in updated:
+                updated[name] = value
+        if updated != cls.baseline:
+            with open(BASELINE_FILE, 'w') as file:
+                json.dump(updated, file, indent=2, sort_keys=True)
+        if cls.uncompared:
+            warnings.warn('NOT COMPARED: no baseline for %s of %s benchmarks, recorded them to %s: %s'
+                          % (len(cls.uncompared), len(cls.results), BASELINE_FILE, ', '.join(cls.uncompared)))
+
+    def measure(self, func, *args):
+        timer = timeit.Timer(lambda: func(*args), timer=time.process_time)
+        number = 1
+        while True:
+            elapsed = timer.timeit(number)
+            if elapsed >= MIN_TIME / 10:
+                break
+            number *= 10
+        number = max(1, int(number * MIN_TIME / elapsed))
+        timer.timeit(number)
+        return min(timer.repeat(repeat=REPEAT, number=number)) / number * 1e6
+
+    def bench(self, name, func, *args):
+        per_call = self.measure(func, *args)
+        base = None if UPDATE else self.baseline.get(name)
+        if not base:
+            self.results[name] = round(per_call, 4)
+            if not UPDATE:
+                self.uncompared.append(name)
+            return
+        for _ in range(REMEASURE):
+            if (per_call - base) / base * 100 <= THRESHOLD:
+                break
+            time.sleep(REMEASURE_PAUSE)
+            per_call = min(per_call, self.measure(func, *args))
+        self.results[name] = round(per_call, 4)
+        change = (per_call - base) / base * 100
+        self.assertLessEqual(change, THRESHOLD, '%s: %.3f us per call, baseline %.3f us (%+.1f%%)'
+                             % (name, per_call, base, change))
+
+    def test_fields(self):
+        fields = {
+            'char': (api.CharField(nullable=True), 'Ivanov', 42),
+            'arguments': (api.ArgumentsField(nullable=True), {'phone': '79175002040'}, ['phone']),
+            'email': (api.EmailField(nullable=True), 'stupnikov@otus.ru', 'stupnikovotus.ru'),
+            'phone': (api.PhoneField(nullable=True), 79175002040, '89175002040'),
+            'date': (api.DateField(nullable=True), '20.07.2017', '2017-07-20'),
+            'birthday': (api.BirthDayField(nullable=True), '01.01.1990', '01.01.1890'),
+            'gender': (api.GenderField(nullable=True), 1, 3),
+            'client_ids': (api.ClientIDsField(required=True), list(range(1000)), ['1', '2']),
+        }
+        for name, (field, valid, invalid) in fields.items():
+            with self.subTest(field=name):
+                self.bench('field.%s.valid' % name, validate, field, valid)
+                self.bench('field.%s.invalid' % name, validate, field, invalid)
+
+    def test_requests(self):
+        requests = {
+            'online_score': (api.OnlineScoreRequest,
+                             {'phone': '79175002040', 'email': 'stupnikov@otus.ru', 'gender': 1,
+                              'birthday': '01.01.1990', 'first_name': 'a', 'last_name': 'b'},
+                             {'phone': '79175002040', 'birthday': '01.01.1890', 'first_name': 's'}),
+            'clients_interests': (api.ClientsInterestsRequest,
+                                  {'client_ids': list(range(1000)), 'date': '20.07.2017'},
+                                  {'client_ids': [1, -2], 'date': 'XXX'}),
+            'method': (api.MethodRequest,
+                       {'account': 'horns&hoofs', 'login': 'h&f', 'method': 'online_score',
+                        'token': valid_token('horns&hoofs', 'h&f'), 'arguments': {}},
+                       {'account': 'horns&hoofs', 'login': 1, 'arguments': []}),
+        }
+        for name, (request_cls, valid, invalid) in requests.items():
+            with self.subTest(request=name):
+                self.bench('request.%s.valid' % name, build, request_cls, valid)
+                self.bench('request.%s.invalid' % name, build, request_cls, invalid)
+
+    def test_check_auth(self):
+        user = api.MethodRequest({'account': 'horns&hoofs', 'login': 'h&f', 'method': 'online_score',
+                                  'token': valid_token('horns&hoofs', 'h&f'), 'arguments': {}})
+        admin = api.MethodRequest({'account': 'horns&hoofs', 'login': api.ADMIN_LOGIN, 'method': 'online_score',
+                                   'token': admin_token(), 'arguments': {}})
+        forbidden = api.MethodRequest({'account': 'horns&hoofs', 'login': 'h&f', 'method': 'online_score',
+                                       'token': 'bad', 'arguments': {}})
+        self.bench('check_auth.user', api.check_auth, user)
+        self.bench('check_auth.admin', api.check_auth, admin)
+        self.bench('check_auth.forbidden', api.check_auth, forbidden)
+
+    def test_get_score(self):
+        arguments = ('79175002040', 'stupnikov@otus.ru', '01.01.1990', 1, 'a', 'b')
+        hit_store = MemoryStore()
+        scoring.get_score(hit_store, *arguments)
+        self.bench('get_score.hit', scoring.get_score, hit_store, *arguments)
+        self.bench('get_score.miss', scoring.get_score, MissStore(), *arguments)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import threading
+import time
+import unittest
+from admission import AdmissionController, Rejected, ADMIN_PRIORITY, CHEAP_PRIORITY, HEAVY_PRIORITY
+from libtools import cases
+
+
+def verify_admin(request):
+    return request.get("token") == "good"
+
+
+class TestAdmissionController(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.controller = AdmissionController(max_in_flight=1, queue_size=1, queue_timeout=0.2, heavy_clients=2,
+                                              verify_admin=verify_admin)
+
+    @cases([({"login": "admin", "token": "good", "method": "online_score"}, ADMIN_PRIORITY),
+            ({"login": "admin", "token": "bad", "method": "online_score"}, CHEAP_PRIORITY),
+            ({"login": "admin", "method": "online_score"}, CHEAP_PRIORITY),
+            ({"login": "h&f", "method": "online_score", "arguments": {}}, CHEAP_PRIORITY),
+            ({"login": "h&f", "method": "clients_interests", "arguments": {"client_ids": [1, 2]}}, CHEAP_PRIORITY),
+            ({"login": "h&f", "method": "clients_interests", "arguments": {"client_ids": [1, 2, 3]}},
+             HEAVY_PRIORITY)])
+    def test_priority(self, case):
+        request, priority = case
+        self.assertEqual(self.controller.priority(request), priority)
+
+    def test_admin_priority_needs_verify_admin(self):
+        controller = AdmissionController()
+        self.assertEqual(controller.priority({"login": "admin", "token": "good"}), CHEAP_PRIORITY)
+
+    def wait_for_waiters(self, controller, count):
+        deadline = time.monotonic() + 5
+        while len(controller.waiters) < count:
+            self.assertLess(time.monotonic(), deadline, 'waiters did not queue up')
+            time.sleep(0.001)
+
+    def start(self, controller, request, result):
+        def wait():
+            try:
+                with controller.acquire(request):
+                    result.append(request.get("login", "admitted"))
+            except Rejected:
+                result.append('rejected')
+        waiter = threading.Thread(target=wait)
+        waiter.start()
+        return waiter
+
+    def test_reject_when_queue_full(self):
+        controller = AdmissionController(max_in_flight=1, queue_size=1, queue_timeout=5)
+        request = {"method": "online_score"}
+        result = []
+        with controller.acquire(request):
+            waiter = self.start(controller, request, result)
+            self.wait_for_waiters(controller, 1)
+            with self.assertRaises(Rejected) as err:
+                controller.acquire(request)
+            self.assertGreaterEqual(err.exception.retry_after, 1)
+        waiter.join()
+        self.assertEqual(result, ['admitted'])
+        self.assertEqual(controller.in_flight["online_score"], 0)
+
+    def test_reject_after_queue_timeout(self):
+        request = {"method": "online_score"}
+        with self.controller.acquire(request):
+            with self.assertRaises(Rejected):
+                self.controller.acquire(request)
+
+    def test_limits_per_method(self):
+        controller = AdmissionController(max_in_flight=1, max_total=2, queue_timeout=0)
+        with controller.acquire({"method": "online_score"}):
+            with controller.acquire({"method": "clients_interests"}):
+                self.assertEqual(controller.in_flight, {"online_score": 1, "clients_interests": 1})
+                with self.assertRaises(Rejected):
+                    controller.acquire({"method": "online_score"})
+
+    def test_priority_across_methods(self):
+        controller = AdmissionController(max_in_flight=2, max_total=1, queue_size=4, queue_timeout=5,
+                                         heavy_clients=2, verify_admin=verify_admin)
+        result = []
+        with controller.acquire({"method": "online_score"}):
+            heavy = self.start(controller, {"login": "h&f", "method": "clients_interests",
+                                            "arguments": {"client_ids": [1, 2, 3]}}, result)
+            self.wait_for_waiters(controller, 1)
+            admin = self.start(controller, {"login": "admin", "token": "good", "method": "online_score"}, result)
+            self.wait_for_waiters(controller, 2)
+        heavy.join()
+        admin.join()
+        self.assertEqual(result, ['admin', 'h&f'])
+
+    @cases([["online_score"], {"x": 1}, "unknown", None])
+    def test_unknown_method_shares_default_bucket(self, method):
+        controller = AdmissionController(max_in_flight=1, queue_timeout=0)
+        with controller.acquire({"method": method}):
+            self.assertEqual(controller.in_flight, {None: 1})
+        self.assertEqual(list(controller.in_flight), [None])
+        self.assertEqual(list(controller.service_time), [None])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -127,12 +127,19 @@ class TestGenderField(unittest.TestCase):
 
 class ClientIDsField(unittest.TestCase):
 
-    @cases([['1', '2', '3'], '1'])
+    @cases([['1', '2', '3'], '1', [1, -2], [1.5], [2 ** 64], {1: 2}])
     def test_client_ids_field_typeerror(self, string):
         self.field_id = api.ClientIDsField(required=True, nullable=True)
         with self.assertRaises(api.ValidationError):
             self.field_id.valid_field(string)
 
+    @cases([[1, 2, 3, 4, 5], [3, 3, 0]])
+    def test_client_ids_field_clean(self, string):
+        field_id = api.ClientIDsField(required=True, nullable=True)
+        ids = field_id.clean(string)
+        self.assertEqual(ids.typecode, 'q')
+        self.assertEqual(list(ids), string)
+
     @cases([[1, 2, 3, 4, 5]])
     def est_client_ids_field_request(self, string):
         self.field_id._value = string
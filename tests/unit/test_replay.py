@@ -0,0 +1,79 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import replay
+from capture import Capture
+from libtools import cases
+
+
+class EchoHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        body = json.dumps({"response": request["arguments"], "code": 200}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestReplay(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.path = os.path.join(tempfile.mkdtemp(), 'capture.jsonl')
+
+    def tearDown(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_capture_and_load(self):
+        capture = Capture(self.path)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        # a slow request that arrived first is written after a fast one
+        capture.record("/method/", {"method": "online_score"}, {"error": "Forbidden", "code": 403}, ts=12.0)
+        capture.record("/method/", {"method": "online_score"}, {"response": {"score": 3.0}, "code": 200}, ts=10.0)
+        capture.close()
+        records = replay.load(self.path)
+        self.assertEqual([record["ts"] for record in records], [10.0, 12.0])
+        self.assertEqual(records[1]["answer"], {"error": "Forbidden", "code": 403})
+
+    @cases([(1.0, [0.0, 1.0, 4.0]), (2.0, [0.0, 0.5, 2.0]), (0, [0.0, 0.0, 0.0])])
+    def test_schedule(self, case):
+        speed, offsets = case
+        records = [{"ts": 100.0}, {"ts": 101.0}, {"ts": 104.0}]
+        self.assertEqual(replay.schedule(records, speed), offsets)
+
+    def test_schedule_from_earliest(self):
+        records = [{"ts": 101.0}, {"ts": 100.0}, {"ts": 104.0}]
+        self.assertEqual(replay.schedule(records, 1.0), [1.0, 0.0, 4.0])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(replay.percentile(values, 50), 51)
+        self.assertEqual(replay.percentile(values, 99), 99)
+        self.assertEqual(replay.percentile([], 50), 0.0)
+
+    def test_replay_reports_diffs(self):
+        server = HTTPServer(("localhost", 0), EchoHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        records = [{"ts": 0.0, "path": "/method/", "request": {"arguments": {"a": 1}},
+                    "answer": {"response": {"a": 1}, "code": 200}},
+                   {"ts": 0.0, "path": "/method/", "request": {"arguments": {"b": 2}},
+                    "answer": {"response": {"b": 3}, "code": 200}}]
+        try:
+            results = replay.replay(records, "http://localhost:%s" % server.server_port, speed=0, concurrency=2)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertTrue(all(latency is not None for latency, _ in results))
+        self.assertIn("requests: 2, failed: 0, response diffs: 1", replay.report(records, results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+import rpc
+from libtools import cases
+
+
+def echo(body, request_id):
+    if body == b'slow':
+        time.sleep(0.2)
+    if body == b'fail':
+        raise RuntimeError('dispatch failed')
+    return body.upper()
+
+
+def blocking(release):
+    def dispatch(body, request_id):
+        release.wait(5)
+        return body
+    return dispatch
+
+
+class TestFrame(unittest.TestCase):
+
+    def test_pack_and_read(self):
+        frame = rpc.pack_frame(7, b'{"method": "online_score"}')
+        self.assertEqual(rpc.read_frame(io.BytesIO(frame)), (7, b'{"method": "online_score"}'))
+
+    def test_read_truncated(self):
+        frame = rpc.pack_frame(7, b'body')
+        self.assertEqual(rpc.read_frame(io.BytesIO(frame[:-1])), (None, None))
+        self.assertEqual(rpc.read_frame(io.BytesIO(b'')), (None, None))
+
+    def test_read_too_large(self):
+        frame = rpc.FRAME_HEADER.pack(1, rpc.MAX_FRAME_SIZE + 1)
+        with self.assertRaises(ValueError):
+            rpc.read_frame(io.BytesIO(frame))
+
+
+class TestServer(unittest.TestCase):
+
+    def check_server(self, address):
+        server = rpc.make_server(address, echo)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = rpc.RPCClient(server.server_address, timeout=5)
+        try:
+            self.assertEqual(client.call(b'abc'), b'ABC')
+            slow = client.send(b'slow')
+            fast = client.send(b'fast')
+            self.assertEqual(client.receive(fast), b'FAST')
+            self.assertEqual(client.receive(slow), b'SLOW')
+            self.assertEqual(json.loads(client.call(b'fail'))["code"], rpc.INTERNAL_ERROR)
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+
+    def test_tcp(self):
+        self.check_server(("localhost", 0))
+
+    def test_unix_socket(self):
+        path = os.path.join(tempfile.mkdtemp(), 'rpc.sock')
+        self.check_server(path)
+        self.assertFalse(os.path.exists(path))
+
+    def test_unix_socket_stale_file(self):
+        path = os.path.join(tempfile.mkdtemp(), 'rpc.sock')
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        self.check_server(path)
+
+    def test_unix_socket_in_use(self):
+        path = os.path.join(tempfile.mkdtemp(), 'rpc.sock')
+        server = rpc.make_server(path, echo)
+        try:
+            with self.assertRaises(OSError):
+                rpc.make_server(path, echo)
+            self.assertTrue(os.path.exists(path))
+        finally:
+            server.server_close()
+
+    @cases([{"max_pending": 1}, {"max_connection_pending": 1}])
+    def test_overload_answers_503(self, limits):
+        release = threading.Event()
+        server = rpc.make_server(("localhost", 0), blocking(release), workers=2, **limits)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = rpc.RPCClient(server.server_address, timeout=5)
+        try:
+            first = client.send(b'first')
+            second = client.send(b'second')
+            self.assertEqual(json.loads(client.receive(second))["code"], rpc.SERVICE_UNAVAILABLE)
+            release.set()
+            self.assertEqual(client.receive(first), b'first')
+        finally:
+            client.close()
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import datetime
+import json
+import unittest
+import scoring
+from libtools import cases, MemoryStore
+
+
+class TestScore(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.store = MemoryStore()
+
+    def test_zero_score_cached(self):
+        self.assertEqual(scoring.get_score(self.store, None, None, gender=1), 0)
+        self.store.cache_set = None
+        self.assertEqual(scoring.get_score(self.store, None, None, gender=1), 0)
+
+    @cases([({"first_name": "ab", "last_name": "c"}, {"first_name": "a", "last_name": "bc"}),
+            ({"phone": "79175002040", "email": "a@b.ru"}, {"phone": "79175002040", "email": "c@d.ru"}),
+            ({"birthday": "01.01.2000", "gender": 1}, {"birthday": "01.01.2000", "gender": 2})])
+    def test_score_key_unambiguous(self, case):
+        first, second = case
+        self.assertNotEqual(scoring.score_key(**first), scoring.score_key(**second))
+        self.assertTrue(scoring.score_key(**first).startswith("s%d:" % scoring.SCORE_CACHE_VERSION))
+
+    def test_legacy_key_fallback(self):
+        legacy_key = scoring.legacy_score_key("79175002040", None, "a", "b")
+        self.store.cache_set(legacy_key, 7.0, 60)
+        self.assertEqual(scoring.get_score(self.store, "79175002040", "a@b.ru", first_name="a", last_name="b"), 7.0)
+        key = scoring.score_key("79175002040", "a@b.ru", first_name="a", last_name="b")
+        self.assertEqual(self.store.cache_get(key), None)
+        del self.store.data[legacy_key]
+        self.assertEqual(scoring.get_score(self.store, "79175002040", "a@b.ru", first_name="a", last_name="b"), 3.5)
+        self.assertEqual(self.store.cache_get(key), "3.5")
+
+
+class TestInterests(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.store = MemoryStore()
+        self.store.cache_set("i:1", json.dumps(["flat"]), 60)
+        self.store.cache_set("i:2", json.dumps(["flat"]), 60)
+        scoring.set_interests(self.store, 1, ["cars", "pets"], datetime.date(2017, 7, 1))
+        scoring.set_interests(self.store, 1, ["tv", "geek"], datetime.date(2017, 7, 20))
+
+    @cases([(datetime.date(2017, 7, 19), ["cars", "pets"]),
+            (datetime.date(2017, 7, 20), ["tv", "geek"]),
+            (None, ["tv", "geek"]),
+            (datetime.date(2017, 6, 30), ["flat"])])
+    def test_interests_as_of_date(self, case):
+        date, interests = case
+        self.assertEqual(scoring.get_interests(self.store, 1, date), interests)
+
+    def test_same_day_overwrite(self):
+        scoring.set_interests(self.store, 4, ["travel"], datetime.date(2017, 7, 1))
+        scoring.set_interests(self.store, 4, ["cars"], datetime.date(2017, 7, 1))
+        self.assertEqual(scoring.get_interests(self.store, 4, datetime.date(2017, 7, 1)), ["cars"])
+        self.assertEqual(len(self.store.index["iz:4"]), 1)
+
+    @cases([["cars", "pets"], ["otus", "cars", "geek"], [], ["unknown", "cars"]])
+    def test_encode_decode_interests(self, interests):
+        value = scoring.encode_interests(interests)
+        self.assertEqual(sorted(scoring.decode_interests(value)), sorted(interests))
+
+    def test_bitset_encoding(self):
+        self.assertEqual(scoring.encode_interests(["cars", "pets"]), str(3 << scoring.INTEREST_VERSION_BITS | 1))
+        self.assertTrue(scoring.encode_interests(["unknown"]).startswith("["))
+        self.assertEqual(scoring.decode_interests_many(["49", '["tv"]', None, "49"]),
+                         [["cars", "pets"], ["tv"], [], ["cars", "pets"]])
+
+    @cases([('"legacy"', "legacy"), ('{"a": 1}', {"a": 1}), (' [ "tv" ]', ["tv"]),
+            (str(3 << scoring.INTEREST_VERSION_BITS | 15), [])])
+    def test_decode_legacy_and_unknown_version(self, case):
+        value, interests = case
+        self.assertEqual(scoring.decode_interests(value), interests)
+
+    def test_interests_many_legacy_value(self):
+        self.store.cache_set("i:5", '"legacy"', 60)
+        self.assertEqual(scoring.get_interests_many(self.store, [5, 2]), {5: "legacy", 2: ["flat"]})
+
+    def test_interests_many_bitset_and_json(self):
+        self.store.cache_set("i:3", scoring.encode_interests(["books", "sport"]), 60)
+        interests = scoring.get_interests_many(self.store, [3, 2], None)
+        self.assertEqual(interests, {3: ["sport", "books"], 2: ["flat"]})
+
+    def test_interests_many_fallback(self):
+        interests = scoring.get_interests_many(self.store, [3, 2, 1], datetime.date(2017, 7, 2))
+        self.assertEqual(list(interests), [3, 2, 1])
+        self.assertEqual(interests, {3: [], 2: ["flat"], 1: ["cars", "pets"]})
+
+
+if __name__ == "__main__":
+    unittest.main()
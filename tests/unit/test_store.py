@@ -1,3 +1,6 @@
+import os
+import tempfile
+import threading
 import unittest
 import store
 import time
@@ -25,24 +28,54 @@ class TestStore(unittest.TestCase):
     def test_connection_error(self):
         self.storage_redis.server.get = mock.MagicMock(side_effect=ConnectionError)
         self.storage_redis.server.set = mock.MagicMock(side_effect=ConnectionError)
+        self.storage_redis.get_with_ttl = mock.MagicMock(side_effect=ConnectionError)
         self.assertEqual(self.storage.cache_set('key', 'value', 60), None)
         self.assertEqual(self.storage.cache_get('key'), None)
-        self.assertEqual(self.storage.store.server.get.call_count, self.attempt_request)
+        self.assertEqual(self.storage.store.get_with_ttl.call_count, self.attempt_request)
         self.assertEqual(self.storage.store.server.set.call_count, self.attempt_request)
         with self.assertRaises(ConnectionError):
             self.storage.get('key')
-        self.assertEqual(self.storage.store.server.get.call_count, self.attempt_request * 2)
+        self.assertEqual(self.storage.store.server.get.call_count, self.attempt_request)
 
     @cases([{'i1': 1}, {'i2': ["cars", "pets"]}, {'i3': '1234'}])
     @mock.patch.object(store.redis.Redis, 'get')
-    def test_mocked_store_cache_get_and_get(self, argument, mocked_get):
+    @mock.patch.object(store.redis.client.Pipeline, 'execute')
+    def test_mocked_store_cache_get_and_get(self, argument, mocked_execute, mocked_get):
         key = list(argument.keys())[0]
-        mocked_get.return_value = argument[key]
+        mocked_execute.return_value = [argument[key], -1]
         self.assertEqual(self.storage.cache_get(key), argument[key])
-        mocked_get.assert_called_once_with(key)
+        mocked_execute.assert_called_with()
+        mocked_get.return_value = argument[key]
         self.assertEqual(self.storage.get(key), argument[key])
         mocked_get.assert_called_with(key)
 
+    @mock.patch.object(store.redis.client.Pipeline, 'execute')
+    @mock.patch.object(store.redis.client.Pipeline, 'pttl')
+    @mock.patch.object(store.redis.client.Pipeline, 'get')
+    def test_mocked_store_get_with_ttl(self, mocked_get, mocked_pttl, mocked_execute):
+        mocked_execute.return_value = ['1.5', 5000]
+        self.assertEqual(self.storage_redis.get_with_ttl('s1:a'), ('1.5', 5000))
+        mocked_get.assert_called_once_with('s1:a')
+        mocked_pttl.assert_called_once_with('s1:a')
+        mocked_execute.assert_called_once()
+
+    @mock.patch.object(store.redis.client.Pipeline, 'execute')
+    @mock.patch.object(store.redis.client.Pipeline, 'zadd')
+    @mock.patch.object(store.redis.client.Pipeline, 'zremrangebyscore')
+    def test_mocked_store_index_set_replaces_bucket(self, mocked_zrem, mocked_zadd, mocked_execute):
+        mocked_execute.return_value = [1, 1]
+        self.assertEqual(self.storage.index_set('iz:1', 736511, '20170701:49'), 1)
+        mocked_zrem.assert_called_once_with('iz:1', 736511, 736511)
+        mocked_zadd.assert_called_once_with('iz:1', {'20170701:49': 736511})
+
+    @mock.patch.object(store.redis.Redis, 'mget')
+    def test_mocked_store_get_many(self, mocked_mget):
+        mocked_mget.return_value = ['["cars"]', None]
+        self.assertEqual(self.storage.get_many(['i:1', 'i:2']), ['["cars"]', None])
+        mocked_mget.assert_called_once_with(['i:1', 'i:2'])
+        self.assertEqual(self.storage.get_many([]), [])
+        mocked_mget.assert_called_once()
+
     def test_cache_note_false(self):
         self.assertEqual(self.storage.get('i:1'), '1')
         time.sleep(1)
@@ -55,6 +88,95 @@ class TestStore(unittest.TestCase):
         self.assertEqual(self.storage.cache_get('i:2'), None)
         self.assertEqual(self.storage.cache_get('i:1'), '1')
 
+
+class TestSnapshot(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.path = os.path.join(tempfile.mkdtemp(), 'cache.snapshot')
+        self.storage_redis = mock.MagicMock()
+        self.storage_redis.get_with_ttl.return_value = (None, -2)
+        self.storage = store.Store(self.storage_redis, attempt_request=2, cache_size=3)
+        self.storage.enable_snapshot(self.path)
+
+    def tearDown(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_cache_get_from_l1(self):
+        self.storage.cache_set('s1:a', 1.5, 60)
+        self.assertEqual(self.storage.cache_get('s1:a'), '1.5')
+        self.storage_redis.get_with_ttl.assert_not_called()
+
+    def test_snapshot_reload(self):
+        self.storage.cache_set('s1:a', 1.5, 60)
+        self.storage.cache_set('s1:b', 0.0, 60)
+        self.storage.cache_set('s1:c', 3.0, 1)
+        self.storage.close()
+        with mock.patch.object(store.time, 'time', return_value=time.time() + 2):
+            restarted = store.Store(self.storage_redis, attempt_request=2, cache_size=3)
+            restarted.enable_snapshot(self.path)
+            self.assertEqual(restarted.cache_get('s1:a'), '1.5')
+            self.assertEqual(restarted.cache_get('s1:b'), '0.0')
+            self.assertEqual(restarted.cache_get('s1:c'), None)
+        self.storage_redis.get_with_ttl.assert_called_once_with('s1:c')
+
+    def test_snapshot_keeps_lru_order(self):
+        for key in ('s1:a', 's1:b', 's1:c'):
+            self.storage.cache_set(key, 1.0, 60)
+        self.storage.cache_get('s1:a')
+        self.storage.close()
+        restarted = store.Store(self.storage_redis, attempt_request=2, cache_size=3)
+        restarted.enable_snapshot(self.path)
+        restarted.cache_set('s1:d', 2.0, 60)
+        self.assertEqual(restarted.cache_get('s1:d'), '2.0')
+        self.assertEqual(list(restarted.cache), ['s1:c', 's1:a', 's1:d'])
+
+    def test_idle_restart_keeps_snapshot(self):
+        self.storage.cache_set('s1:a', 1.5, 60)
+        self.storage.close()
+        for _ in range(2):
+            idle = store.Store(self.storage_redis, attempt_request=2, cache_size=3)
+            idle.enable_snapshot(self.path)
+            idle.close()
+        self.assertEqual([entry[:2] for entry in store.read_snapshot(self.path)], [('s1:a', '1.5')])
+
+    def test_periodic_save_survives_errors(self):
+        saved = threading.Event()
+        failures = [OSError, OSError]
+
+        def write(path, entries):
+            if failures:
+                raise failures.pop()
+            saved.set()
+
+        periodic = store.Store(self.storage_redis, attempt_request=2, cache_size=3)
+        with mock.patch.object(store, 'write_snapshot', side_effect=write):
+            periodic.enable_snapshot(self.path, interval=0.01)
+            self.assertTrue(saved.wait(5))
+            periodic.close()
+        self.assertFalse(periodic.snapshot_saver.is_alive())
+
+    @cases([(-1, 60), (5000, 5), (120000, 60)])
+    def test_cache_get_follows_redis_ttl(self, case):
+        pttl, ttl = case
+        self.storage_redis.get_with_ttl.return_value = ('1.5', pttl)
+        with mock.patch.object(store.time, 'time', return_value=1000.0):
+            self.assertEqual(self.storage.cache_get('s1:%s' % pttl), '1.5')
+        self.assertEqual(self.storage.cache['s1:%s' % pttl], ('1.5', 1000.0 + ttl))
+
+    def test_cache_get_expired_ttl_not_kept(self):
+        self.storage_redis.get_with_ttl.return_value = ('1.5', -2)
+        self.assertEqual(self.storage.cache_get('s1:a'), '1.5')
+        self.assertNotIn('s1:a', self.storage.cache)
+
+    @cases([b'', b'garbage', b'SCL1\x00\x00\x00\x05'])
+    def test_broken_snapshot(self, content):
+        with open(self.path, 'wb') as file:
+            file.write(content)
+        self.assertEqual(store.read_snapshot(self.path), [])
+        self.assertEqual(self.storage.cache_get('s1:a'), None)
+
+
 class TestWorksRedis(unittest.TestCase):
 
     def setUp(self) -> None:
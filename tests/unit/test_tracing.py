@@ -0,0 +1,45 @@
+import json
+import os
+import tempfile
+import unittest
+import tracing
+
+
+class TestTracing(unittest.TestCase):
+
+    def test_span_without_trace(self):
+        with tracing.span('store_get') as span:
+            span.retries = 2
+        self.assertEqual(span.duration, 0.0)
+
+    def test_trace_timing(self):
+        context = {"request_id": "abc"}
+        with tracing.trace(context) as trace:
+            with tracing.span('validate'):
+                pass
+            with tracing.span('store_get') as span:
+                span.retries = 1
+            with tracing.span('store_get'):
+                pass
+            header = trace.server_timing()
+        self.assertEqual(sorted(context["timing"]), ['store_get', 'validate'])
+        self.assertEqual(len(trace.spans), 3)
+        self.assertRegex(header, r'^validate;dur=[\d.]+, store_get;dur=[\d.]+;desc="retries=1"$')
+
+    def test_file_exporter(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        exporter = tracing.FileExporter(path)
+        with tracing.trace({"request_id": "abc"}, exporter):
+            with tracing.span('auth'):
+                pass
+        exporter.close()
+        with open(path) as file:
+            record = json.loads(file.readline())
+        os.remove(path)
+        self.assertEqual(record["request_id"], "abc")
+        self.assertEqual([span["name"] for span in record["spans"]], ['auth'])
+
+
+if __name__ == "__main__":
+    unittest.main()
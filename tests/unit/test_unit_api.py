@@ -1,7 +1,11 @@
+import admission
 import api
 import datetime
 import hashlib
+import json
 import unittest
+import unittest.mock as mock
+from libtools import cases
 
 
 class TestUnitApiCheckAuth(unittest.TestCase):
@@ -27,6 +31,30 @@ class TestUnitApiCheckAuth(unittest.TestCase):
     def test_check_auth_user(self):
         self.assertEqual(api.check_auth(self.method(self.request)), True)
 
+    def test_verify_admin(self):
+        self.request['login'] = 'admin'
+        self.assertEqual(api.verify_admin(self.request), False)
+        self.request['token'] = api.admin_token()
+        self.assertEqual(api.verify_admin(self.request), True)
+        self.assertEqual(api.MainHTTPHandler.admission.priority(self.request), admission.ADMIN_PRIORITY)
+
+
+class TestUnitApiDispatch(unittest.TestCase):
+
+    @cases([["online_score"], {"x": 1}])
+    def test_dispatch_invalid_method(self, method):
+        request = {"account": "horns&hoofs", "login": "h&f", "method": method, "token": "", "arguments": {}}
+        response, code, _ = api.dispatch(api.method_handler, request, {"request_id": "1"},
+                                         None, admission.AdmissionController())
+        self.assertEqual(code, api.INVALID_REQUEST)
+        self.assertEqual(response, {"method": "This value must be a string"})
+
+    @mock.patch.object(api, 'logger')
+    def test_rpc_handler_request_id(self, mocked_logger):
+        body = api.rpc_handler(b'not json', 7)
+        self.assertEqual(json.loads(body)["code"], api.BAD_REQUEST)
+        self.assertEqual(mocked_logger.info.call_args[0][0]["request_id"], 7)
+
 
 
 if __name__ == '__main__':
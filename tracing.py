@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class Span:
+    __slots__ = ('name', 'start', 'duration', 'retries')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+        self.duration = 0.0
+        self.retries = 0
+
+    def as_dict(self):
+        return {'name': self.name, 'start': round(self.start * 1000, 3),
+                'dur': round(self.duration * 1000, 3), 'retries': self.retries}
+
+
+class Trace:
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.spans = []
+
+    def timing(self):
+        timing = {}
+        for span in self.spans:
+            dur, retries = timing.get(span.name, (0.0, 0))
+            timing[span.name] = (dur + span.duration * 1000, retries + span.retries)
+        return timing
+
+    def server_timing(self):
+        metrics = []
+        for name, (dur, retries) in self.timing().items():
+            metric = '%s;dur=%.3f' % (name, dur)
+            if retries:
+                metric += ';desc="retries=%s"' % retries
+            metrics.append(metric)
+        return ', '.join(metrics)
+
+    def as_dict(self):
+        return {'request_id': self.request_id, 'spans': [span.as_dict() for span in self.spans]}
+
+
+class FileExporter:
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.file = open(path, 'a', buffering=1, encoding='utf-8')
+
+    def export(self, trace):
+        line = json.dumps(trace.as_dict())
+        with self.lock:
+            self.file.write(line + '\n')
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+@contextmanager
+def trace(context, exporter=None):
+    current = Trace(context.get('request_id'))
+    _local.trace = current
+    try:
+        yield current
+    finally:
+        _local.trace = None
+        context['timing'] = {name: round(dur, 3) for name, (dur, _) in current.timing().items()}
+        if exporter is not None:
+            exporter.export(current)
+
+
+@contextmanager
+def span(name):
+    current_trace = getattr(_local, 'trace', None)
+    current = Span(name)
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        if current_trace is not None:
+            current.start = start - current_trace.started
+            current.duration = time.perf_counter() - start
+            current_trace.spans.append(current)